@@ -1,37 +1,95 @@
+import ctypes
+import sys
 import sounddevice as sd
-import scipy.io.wavfile as wav
 import numpy as np
 import keyboard
+import struct
 import requests
-import tempfile
 import pyperclip
 import time
-import os
+import uuid
 
 # === Настройки ===
 API_URL = "http://127.0.0.1:6431/transcribe"  # твой локальный API
 LANGUAGE = "ru"        # "ru", "en", "auto"
 MODEL = "turbo"        # Whisper модель: tiny, base, small, medium, large, turbo
-USE_CLIPBOARD = True   # True = вставка через Ctrl+V, False = посимвольный ввод
+USE_SENDINPUT = sys.platform == "win32"  # True = ввод через SendInput, буфер обмена не трогаем
+USE_CLIPBOARD = True   # без SendInput: True = вставка через Ctrl+V, False = посимвольный ввод
 samplerate = 16000     # Whisper любит 16кГц
+CONNECT_TIMEOUT = 5    # таймаут подключения к серверу, сек (ответ ждём сколько нужно)
+UPLOAD_CHUNK = 64 * 1024  # размер куска аудио при отправке, байт
+MAX_SECONDS = 600      # максимальная длина одной записи, сек (округляется вверх)
+MIN_SECONDS = 0.25     # записи короче не отправляем
+SILENCE_LEVEL = 200    # средняя амплитуда (int16), ниже которой запись считаем тишиной
+GATE_CHUNK_FRAMES = 32 * 1024  # размер куска при проверке на тишину, кадров
 
 # === Глобальные переменные ===
 is_recording = False
-recording_data = []
+# Кольцевой буфер (степень двойки) выделяется один раз: callback только пишет
+# в него и двигает head, основной поток читает с record_start до head
+RING_CAP = 1 << (samplerate * MAX_SECONDS - 1).bit_length()
+RING_MASK = RING_CAP - 1
+ring = np.empty((RING_CAP, 1), dtype=np.int16)
+head = ctypes.c_uint64(0)  # сколько кадров записано всего
+record_start = 0           # значение head в начале текущей записи
+# Одно keep-alive соединение с сервером на всё время работы
+SESSION = requests.Session()
+SESSION.headers.update({"Connection": "keep-alive"})
 LANGUAGE = "ru"  # язык по умолчанию
 
+# === WinAPI для SendInput ===
+if sys.platform == "win32":
+    from ctypes import wintypes
+
+    user32 = ctypes.WinDLL("user32", use_last_error=True)
+
+    INPUT_KEYBOARD = 1
+    KEYEVENTF_KEYUP = 0x0002
+    KEYEVENTF_UNICODE = 0x0004
+
+    class KEYBDINPUT(ctypes.Structure):
+        _fields_ = [
+            ("wVk", wintypes.WORD),
+            ("wScan", wintypes.WORD),
+            ("dwFlags", wintypes.DWORD),
+            ("time", wintypes.DWORD),
+            ("dwExtraInfo", ctypes.c_size_t),
+        ]
+
+    # MOUSEINPUT нужен только для правильного размера union
+    class MOUSEINPUT(ctypes.Structure):
+        _fields_ = [
+            ("dx", wintypes.LONG),
+            ("dy", wintypes.LONG),
+            ("mouseData", wintypes.DWORD),
+            ("dwFlags", wintypes.DWORD),
+            ("time", wintypes.DWORD),
+            ("dwExtraInfo", ctypes.c_size_t),
+        ]
+
+    class _INPUTUNION(ctypes.Union):
+        _fields_ = [("ki", KEYBDINPUT), ("mi", MOUSEINPUT)]
+
+    class INPUT(ctypes.Structure):
+        _anonymous_ = ("u",)
+        _fields_ = [("type", wintypes.DWORD), ("u", _INPUTUNION)]
+
 
 def callback(indata, frames, time_info, status):
-    """Собираем звук в память"""
+    """Собираем звук в кольцевой буфер, без аллокаций"""
     if is_recording:
-        recording_data.append(indata.copy())
+        pos = head.value & RING_MASK
+        first = min(frames, RING_CAP - pos)
+        ring[pos:pos + first] = indata[:first]
+        ring[:frames - first] = indata[first:]  # перенос через конец буфера
+        head.value += frames
 
 
 def toggle_recording():
-    global is_recording, recording_data
+    global is_recording, record_start
     if not is_recording:
         print("🎙 Начало записи...")
-        recording_data = []
+        record_start = head.value
         is_recording = True
     else:
         print("⏹ Остановка записи...")
@@ -39,36 +97,117 @@ def toggle_recording():
         save_and_transcribe()
 
 
+def wav_header(nbytes):
+    """44-байтный заголовок RIFF для моно 16-bit PCM"""
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + nbytes, b"WAVE",
+        b"fmt ", 16, 1, 1, samplerate, samplerate * 2, 2, 16,
+        b"data", nbytes,
+    )
+
+
+def multipart_body(boundary, fields, parts):
+    """Отдаём multipart/form-data по кускам: поля, заголовок WAV, затем PCM
+    из всех частей записи по порядку"""
+    for name, value in fields.items():
+        yield (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+            f"{value}\r\n"
+        ).encode()
+    yield (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="audio.wav"\r\n'
+        "Content-Type: audio/wav\r\n\r\n"
+    ).encode()
+
+    yield wav_header(sum(part.nbytes for part in parts))
+    for part in parts:
+        pcm = memoryview(part).cast("B")
+        for i in range(0, len(pcm), UPLOAD_CHUNK):
+            # urllib3 1.26 принимает в chunked-теле только bytes (memoryview падает),
+            # поэтому копируем кусок; копия не больше UPLOAD_CHUNK
+            yield bytes(pcm[i:i + UPLOAD_CHUNK])
+    yield f"\r\n--{boundary}--\r\n".encode()
+
+
+def post_audio(fields, parts):
+    """Отправляем запись; если сервер закрыл keep-alive соединение прямо во время
+    отправки, собираем одноразовое тело заново и повторяем один раз"""
+    for attempt in range(2):
+        boundary = uuid.uuid4().hex
+        try:
+            return SESSION.post(
+                API_URL,
+                data=multipart_body(boundary, fields, parts),
+                headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+                timeout=(CONNECT_TIMEOUT, None),
+            )
+        except requests.ConnectTimeout:
+            raise
+        except requests.ConnectionError:
+            if attempt:
+                raise
+
+
+def mean_amplitude(parts):
+    """Средняя абсолютная амплитуда по кускам, без временного массива на всю запись"""
+    total = 0
+    count = 0
+    for part in parts:
+        for i in range(0, len(part), GATE_CHUNK_FRAMES):
+            chunk = part[i:i + GATE_CHUNK_FRAMES]
+            # int32, чтобы abs(-32768) не переполнялся
+            total += int(np.abs(chunk, dtype=np.int32).sum(dtype=np.int64))
+            count += len(chunk)
+    return total / count if count else 0
+
+
 def save_and_transcribe():
-    global recording_data, LANGUAGE
-    if not recording_data:
+    global LANGUAGE
+    end = head.value
+    if end == record_start:
         return
 
-    # Склеиваем аудиофрагменты
-    audio = np.concatenate(recording_data, axis=0)
+    # Если запись длиннее буфера, остаются последние RING_CAP кадров
+    n = end - record_start
+    if n > RING_CAP:
+        print("⚠ Запись длиннее буфера, начало обрезано")
+        n = RING_CAP
 
-    # Сохраняем во временный файл
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-        wav.write(f.name, samplerate, audio)
-        temp_path = f.name
+    # Запись в кольце: один кусок или два, если она переходит через конец
+    start = (end - n) & RING_MASK
+    if start + n <= RING_CAP:
+        parts = [ring[start:start + n]]
+    else:
+        first = RING_CAP - start
+        parts = [ring[start:], ring[:n - first]]
+
+    # Случайное нажатие или тишина: не тратим время сервера на Whisper
+    if n < samplerate * MIN_SECONDS or mean_amplitude(parts) < SILENCE_LEVEL:
+        print("🔇 Запись слишком короткая или тихая, пропускаем")
+        return
 
     print(f"📤 Отправка на сервер (язык: {LANGUAGE})...")
     try:
-        with open(temp_path, "rb") as f:
-            files = {"file": ("audio.wav", f, "audio/wav")}
-            data = {
-                "language": LANGUAGE,
-                "model": MODEL,
-                "prompt": ""
-            }
-            resp = requests.post(API_URL, files=files, data=data)
+        # WAV (16-bit PCM) уходит по кускам прямо из кольца, chunked-запросом;
+        # если запись переходит через конец кольца, куски идут по порядку без склейки
+        fields = {
+            "language": LANGUAGE,
+            "model": MODEL,
+            "prompt": ""
+        }
+        resp = post_audio(fields, parts)
 
         resp.raise_for_status()
         text = resp.json()["text"].strip()
         print("✅ Распознано:", text)
 
         # Вставляем текст в активное поле ввода
-        if USE_CLIPBOARD:
+        if USE_SENDINPUT:
+            send_unicode(text)
+        elif USE_CLIPBOARD:
             old_clipboard = pyperclip.paste()  # сохраняем, что было в буфере
             pyperclip.copy(text)
             time.sleep(0.05)
@@ -80,8 +219,23 @@ def save_and_transcribe():
 
     except Exception as e:
         print("❌ Ошибка:", e)
-    finally:
-        os.unlink(temp_path)
+
+
+def send_unicode(text):
+    """Печатаем текст через SendInput с KEYEVENTF_UNICODE, без буфера обмена"""
+    raw = text.encode("utf-16-le")
+    units = struct.unpack(f"<{len(raw) // 2}H", raw)  # 16-битные code units
+    inputs = (INPUT * (2 * len(units)))()
+    for i, unit in enumerate(units):
+        down, up = inputs[2 * i], inputs[2 * i + 1]
+        down.type = up.type = INPUT_KEYBOARD
+        down.ki.wScan = up.ki.wScan = unit
+        down.ki.dwFlags = KEYEVENTF_UNICODE
+        up.ki.dwFlags = KEYEVENTF_UNICODE | KEYEVENTF_KEYUP
+
+    sent = user32.SendInput(len(inputs), inputs, ctypes.sizeof(INPUT))
+    if sent != len(inputs):
+        raise ctypes.WinError(ctypes.get_last_error())
 
 
 def set_language(lang_code, lang_name):
@@ -98,7 +252,9 @@ def main():
     keyboard.add_hotkey("alt+1", lambda: set_language("ru", "Русский"))
     keyboard.add_hotkey("alt+2", lambda: set_language("en", "Английский"))
 
-    with sd.InputStream(samplerate=samplerate, channels=1, callback=callback):
+    with sd.InputStream(
+        samplerate=samplerate, channels=1, dtype="int16", callback=callback
+    ):
         keyboard.wait("alt+esc")
 
 
@@ -1,12 +1,19 @@
+import asyncio
+import io
 import logging
 import os
 import tempfile
+import wave
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
+import numpy as np
 import uvicorn
-import whisper
 from fastapi import FastAPI, File, Form, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from faster_whisper import WhisperModel
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -14,7 +21,8 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="Local Whisper API",
-    description="Local speech-to-text API using OpenAI Whisper",
+    description="Local speech-to-text API using Whisper (faster-whisper)",
+    default_response_class=ORJSONResponse,
 )
 
 # Add CORS middleware to allow requests from Obsidian
@@ -26,29 +34,135 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global variables to store the loaded model and its name
+# Size of the chunks used to copy uploads to disk
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# WAV uploads in Whisper's native format are decoded in-process with numpy
+WAV_CONTENT_TYPES = {"audio/wav", "audio/x-wav", "audio/wave"}
+WHISPER_SAMPLE_RATE = 16000
+
+# CTranslate2 device and compute type, e.g. WHISPER_DEVICE=cuda and
+# WHISPER_COMPUTE_TYPE=int8_float16; "auto" picks the fastest supported one
+WHISPER_DEVICE = os.getenv("WHISPER_DEVICE", "auto")
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "auto")
+
+# Single greedy decoding pass: no beam search and no temperature fallback
+# re-decodes; silence is skipped by the built-in VAD filter
+DECODE_OPTIONS = {
+    "beam_size": 1,
+    "best_of": 1,
+    "temperature": 0.0,
+    "condition_on_previous_text": False,
+    "no_speech_threshold": 0.6,
+    "vad_filter": True,
+}
+
+# Number of loaded models kept in memory; the least recently used is evicted
+MODEL_CACHE_SIZE = 2
+
+# Requests already waiting in the queue (up to BATCH_SIZE) are taken together
+# so model switches happen at most once per model; a lone request never waits
+BATCH_SIZE = 4
+
+# Model loading and inference run on one dedicated thread so they never block
+# the event loop; a single worker keeps access to the model serialized
+EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper")
+
+# Global variables to store the loaded models and the active one
+MODEL_CACHE: "OrderedDict[str, WhisperModel]" = OrderedDict()
 whisper_model = None
 current_model_name = None
 
+# Queue of pending (model, audio, options, future) transcription requests
+transcription_queue: Optional[asyncio.Queue] = None
+batch_worker_task: Optional[asyncio.Task] = None
+
 
 def load_whisper_model(model_name: str = "turbo"):
-    """Load the Whisper model into memory"""
+    """Make the Whisper model active, loading it into memory if it is not cached"""
     global whisper_model, current_model_name
     try:
-        logger.info(f"Loading Whisper model: {model_name}")
-        whisper_model = whisper.load_model(model_name)
+        if model_name in MODEL_CACHE:
+            logger.info(f"Using cached Whisper model: {model_name}")
+            MODEL_CACHE.move_to_end(model_name)
+        else:
+            # Make room first so at most MODEL_CACHE_SIZE models are ever loaded
+            while len(MODEL_CACHE) >= MODEL_CACHE_SIZE:
+                evicted, _ = MODEL_CACHE.popitem(last=False)
+                if evicted == current_model_name:
+                    whisper_model = None
+                    current_model_name = None
+                logger.info(f"Evicted Whisper model from cache: {evicted}")
+
+            logger.info(f"Loading Whisper model: {model_name}")
+            MODEL_CACHE[model_name] = WhisperModel(
+                model_name, device=WHISPER_DEVICE, compute_type=WHISPER_COMPUTE_TYPE
+            )
+            logger.info(f"Whisper model {model_name} loaded successfully")
+
+        whisper_model = MODEL_CACHE[model_name]
         current_model_name = model_name
-        logger.info(f"Whisper model {model_name} loaded successfully")
         return True
     except Exception as e:
         logger.error(f"Error loading Whisper model: {e}")
         return False
 
 
+def decode_pcm_wav(data: bytes) -> Optional[np.ndarray]:
+    """
+    Decode a 16 kHz mono 16-bit WAV into the float32 array Whisper expects
+
+    Returns None for any other format so the caller can fall back to
+    faster-whisper's own decoder.
+    """
+    try:
+        with wave.open(io.BytesIO(data)) as wav_file:
+            if (
+                wav_file.getnchannels() != 1
+                or wav_file.getsampwidth() != 2
+                or wav_file.getframerate() != WHISPER_SAMPLE_RATE
+            ):
+                return None
+            frames = wav_file.readframes(wav_file.getnframes())
+    except (wave.Error, EOFError):
+        return None
+
+    audio = np.frombuffer(frames, np.int16).astype(np.float32)
+    audio /= 32768.0
+    return audio
+
+
+def warm_up_model():
+    """Run a silent one-second decode to initialize the backend before the first request"""
+    try:
+        logger.info("Warming up Whisper model")
+        # The VAD filter would drop pure silence before it reaches the model
+        run_transcription(
+            np.zeros(WHISPER_SAMPLE_RATE, dtype=np.float32),
+            {**DECODE_OPTIONS, "vad_filter": False},
+        )
+        logger.info("Whisper model warmed up")
+    except Exception as e:
+        logger.warning(f"Whisper model warm-up failed: {e}")
+
+
 @app.on_event("startup")
 async def startup_event():
-    """Load the Whisper model when the server starts"""
-    load_whisper_model()
+    """Load and warm up the Whisper model and start the batch worker"""
+    global transcription_queue, batch_worker_task
+    if load_whisper_model():
+        warm_up_model()
+    transcription_queue = asyncio.Queue()
+    batch_worker_task = asyncio.create_task(batch_worker())
+    batch_worker_task.add_done_callback(on_batch_worker_done)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the batch worker and the inference thread"""
+    if batch_worker_task is not None:
+        batch_worker_task.cancel()
+    EXECUTOR.shutdown(wait=False, cancel_futures=True)
 
 
 @app.get("/")
@@ -68,12 +182,125 @@ async def get_available_models():
     return {"available_models": models, "current_model": current_model_name or "none"}
 
 
+def run_transcription(audio, options: dict) -> dict:
+    """Run faster-whisper and collect its lazy segments into a result dict"""
+    segments, info = whisper_model.transcribe(audio, **options)
+    segments = list(segments)
+    return {
+        "text": "".join(segment.text for segment in segments),
+        "language": info.language,
+        "segments": segments,
+    }
+
+
+def segment_to_dict(segment) -> dict:
+    """Convert a faster-whisper segment into a JSON-serializable dict"""
+    return {
+        "id": segment.id,
+        "seek": segment.seek,
+        "start": segment.start,
+        "end": segment.end,
+        "text": segment.text,
+        "tokens": segment.tokens,
+        "temperature": segment.temperature,
+        "avg_logprob": segment.avg_logprob,
+        "compression_ratio": segment.compression_ratio,
+        "no_speech_prob": segment.no_speech_prob,
+    }
+
+
+async def run_batch(batch: list):
+    """Transcribe a batch of queued requests, switching models at most once per model"""
+    loop = asyncio.get_running_loop()
+    # Requests for the active model go first, the rest are grouped by model
+    batch.sort(key=lambda item: (item[0] != current_model_name, item[0]))
+    for model_name, audio, options, future in batch:
+        if future.cancelled():
+            continue
+        try:
+            if whisper_model is None or current_model_name != model_name:
+                logger.info(
+                    f"Model change detected: {current_model_name} -> {model_name}"
+                )
+                if not await loop.run_in_executor(
+                    EXECUTOR, load_whisper_model, model_name
+                ):
+                    raise HTTPException(
+                        status_code=500, detail="Failed to load Whisper model"
+                    )
+            result = await loop.run_in_executor(
+                EXECUTOR, run_transcription, audio, options
+            )
+        except Exception as e:
+            if not future.cancelled():
+                future.set_exception(e)
+        else:
+            if not future.cancelled():
+                future.set_result(result)
+
+
+async def batch_worker():
+    """Take queued requests together with whatever is already waiting and run them"""
+    while True:
+        batch = [await transcription_queue.get()]
+        while len(batch) < BATCH_SIZE and not transcription_queue.empty():
+            batch.append(transcription_queue.get_nowait())
+
+        logger.info(f"Running transcription batch of {len(batch)} request(s)")
+        try:
+            await run_batch(batch)
+        except Exception as e:
+            logger.error(f"Transcription batch failed: {e}")
+            # Never leave a request waiting on a future nobody will resolve
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+
+def on_batch_worker_done(task: asyncio.Task):
+    """Log the batch worker stopping unexpectedly"""
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Transcription batch worker stopped: {task.exception()}")
+
+
+async def submit_transcription(model: str, audio, options: dict) -> dict:
+    """Queue a transcription request and wait for the batch worker to finish it"""
+    if batch_worker_task is None or batch_worker_task.done():
+        raise HTTPException(
+            status_code=503, detail="Transcription worker is not running"
+        )
+    future = asyncio.get_running_loop().create_future()
+    await transcription_queue.put((model, audio, options, future))
+    return await future
+
+
+async def transcribe_via_temp_file(
+    file: UploadFile, model: str, options: dict
+) -> dict:
+    """Save the upload to a temporary file and let faster-whisper decode it"""
+    with tempfile.NamedTemporaryFile(
+        delete=False, suffix=f".{file.filename.split('.')[-1]}"
+    ) as temp_file:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            temp_file.write(chunk)
+        temp_file_path = temp_file.name
+
+    try:
+        logger.info(f"Transcribing audio file: {file.filename}")
+        return await submit_transcription(model, temp_file_path, options)
+    finally:
+        # Clean up temporary file
+        if os.path.exists(temp_file_path):
+            os.unlink(temp_file_path)
+
+
 @app.post("/transcribe")
 async def transcribe_audio(
     file: UploadFile = File(...),
     model: Optional[str] = Form("turbo"),
     language: Optional[str] = Form("ru"),
     prompt: Optional[str] = Form(""),
+    include_segments: bool = Form(False),
 ):
     """
     Transcribe audio file using local Whisper model
@@ -83,6 +310,7 @@ async def transcribe_audio(
         model: Whisper model to use (tiny, base, small, medium, large)
         language: Language code (e.g., 'en', 'es', 'fr')
         prompt: Optional prompt to guide transcription
+        include_segments: Also return the per-segment timestamps and scores
 
     Returns:
         JSON with transcribed text
@@ -93,61 +321,46 @@ async def transcribe_audio(
         if not file.content_type or not file.content_type.startswith("audio/"):
             raise HTTPException(status_code=400, detail="File must be an audio file")
 
-        # Load model if different from current one or if no model is loaded
-        global whisper_model, current_model_name
-        if whisper_model is None or current_model_name != model:
-            logger.info(f"Model change detected: {current_model_name} -> {model}")
-            if not load_whisper_model(model):
-                raise HTTPException(
-                    status_code=500, detail="Failed to load Whisper model"
-                )
+        # Prepare transcription options
+        options = dict(DECODE_OPTIONS)
+        if language and language != "auto":
+            options["language"] = language
+        if prompt:
+            options["initial_prompt"] = prompt
+
+        # Decode plain PCM WAV uploads in memory, skipping the temp file
+        audio = None
+        if file.content_type in WAV_CONTENT_TYPES:
+            audio = decode_pcm_wav(await file.read())
+            if audio is None:
+                await file.seek(0)
+
+        if audio is not None:
+            logger.info(f"Transcribing in-memory WAV: {file.filename}")
+            result = await submit_transcription(model, audio, options)
         else:
-            logger.info(f"Using already loaded model: {current_model_name}")
-
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(
-            delete=False, suffix=f".{file.filename.split('.')[-1]}"
-        ) as temp_file:
-            content = await file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
-
-        try:
-            # Transcribe the audio
-            logger.info(f"Transcribing audio file: {file.filename}")
-
-            # Prepare transcription options
-            options = {}
-            if language and language != "auto":
-                options["language"] = language
-            if prompt:
-                options["initial_prompt"] = prompt
-
-            # Perform transcription
-            result = whisper_model.transcribe(temp_file_path, **options)
-
-            # Clean up temporary file
-            os.unlink(temp_file_path)
-
-            logger.info("Transcription completed successfully")
-
-            # Ensure first word starts with capital letter
-            transcribed_text = result["text"].strip()
-            if transcribed_text:
-                transcribed_text = transcribed_text[0].upper() + transcribed_text[1:]
-            
-            return {
-                "text": transcribed_text,
-                "language": result.get("language", language),
-                "segments": result.get("segments", []),
-            }
-
-        except Exception as e:
-            # Clean up temporary file in case of error
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
-            raise e
+            result = await transcribe_via_temp_file(file, model, options)
+
+        logger.info("Transcription completed successfully")
+
+        # Ensure first word starts with capital letter
+        transcribed_text = result["text"].strip()
+        # (Whisper usually capitalizes already, so the copy is rarely needed)
+        if transcribed_text and transcribed_text[0].islower():
+            transcribed_text = transcribed_text[0].upper() + transcribed_text[1:]
+
+        response = {
+            "text": transcribed_text,
+            "language": result.get("language", language),
+        }
+        if include_segments:
+            response["segments"] = [
+                segment_to_dict(segment) for segment in result["segments"]
+            ]
+        return response
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error during transcription: {e}")
         raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}")
@@ -167,7 +380,9 @@ async def openai_compatible_endpoint(
     """
     try:
         # Call the main transcribe function
-        result = await transcribe_audio(file, model, language, prompt)
+        result = await transcribe_audio(
+            file, model, language, prompt, include_segments=False
+        )
 
         # Return in OpenAI-compatible format
         return {"text": result["text"], "language": result["language"]}
@@ -180,14 +395,16 @@ async def openai_compatible_endpoint(
 
 
 if __name__ == "__main__":
-    # Load model on startup
-    load_whisper_model()
-
-    # Run the server
+    # The model is loaded once by startup_event in the single worker; the
+    # auto-reloader is only enabled for development (DEV=1)
     uvicorn.run(
         "whisper_api_server:app",
         host="0.0.0.0",
         port=6431,
-        reload=True,
+        reload=os.getenv("DEV", "").lower() in {"1", "true"},
+        workers=1,
+        lifespan="on",
+        # Keep idle client connections open between dictations
+        timeout_keep_alive=300,
         log_level="info",
     )
@@ -1,7 +1,6 @@
 import io
 import os
 import tempfile
-import time
 import wave
 
 import ffmpeg
@@ -18,9 +17,15 @@ def transcribe_audio(audio):
     if audio is None:
         return "Ошибка: аудио не записано. Пожалуйста, запишите фразу через микрофон."
 
-    # Сохранение аудио в временный файл
+    # Создаём временный файл и сразу закрываем его: дальше он открывается
+    # только по имени, и к моменту удаления ни один дескриптор не остаётся открытым
     with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
         temp_file_path = temp_file.name
+        if isinstance(audio, bytes):
+            # Если audio - это blob (bytes), записываем его напрямую
+            temp_file.write(audio)
+
+    try:
         try:
             # Если audio - это tuple (sample_rate, numpy_array)
             if isinstance(audio, tuple) and len(audio) == 2:
@@ -36,13 +41,10 @@ def transcribe_audio(audio):
                     wav_file.setnchannels(1)  # моно
                     wav_file.setsampwidth(2)  # 16-bit
                     wav_file.setframerate(sample_rate)
-                    wav_file.writeframes(audio_data.tobytes())
+                    # Пишем прямо из буфера массива, без копии через tobytes()
+                    wav_file.writeframes(np.ascontiguousarray(audio_data))
 
-            elif isinstance(audio, bytes):
-                # Если audio - это blob (bytes), записываем его напрямую
-                temp_file.write(audio)
-                temp_file.flush()
-            else:
+            elif not isinstance(audio, bytes):
                 # Конвертация аудио в WAV (для filepath)
                 (
                     ffmpeg.input(audio)
@@ -62,17 +64,12 @@ def transcribe_audio(audio):
             print(text)
         except Exception as e:
             text = f"Ошибка при транскрипции: {str(e)}"
-        finally:
-            # Попытка удаления файла с небольшой задержкой
-            for _ in range(5):  # Пять попыток
-                try:
-                    os.unlink(temp_file_path)
-                    break
-                except PermissionError:
-                    time.sleep(0.5)  # Задержка 0.5 секунды перед повторной попыткой
-                except Exception as e:
-                    print(f"Ошибка при удалении файла: {str(e)}")
-                    break
+    finally:
+        # Файл уже закрыт (ffmpeg к этому моменту тоже завершился), удаляем сразу
+        try:
+            os.unlink(temp_file_path)
+        except OSError as e:
+            print(f"Ошибка при удалении файла: {str(e)}")
 
     return text
 